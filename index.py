@@ -4,15 +4,28 @@ Coleman async downloader
 ────────────────────────
 - Nhập mã sản phẩm thủ công, queue cho đến khi gõ 'yes'
 - Tải ảnh + mô tả (JP) + dịch sang TIẾNG VIỆT
+- Mô tả lưu vào <mã>.jp.txt & <mã>.vi.txt; chạy với --desc-json để lưu
+  desc.json ({"pid", "jp", "vi"}) thay cho 2 file txt
 """
 
 import asyncio
+import hashlib
+import html as htmllib
 import logging
+import multiprocessing
+import os
+import random
 import re
+import shutil
+import socket
+import sqlite3
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import aiofiles
+from aiofile import async_open  # caio (libaio) trên Linux, thread pool ở nơi khác
 
 # Import tkinter cho file picker (có sẵn trong Python)
 try:
@@ -21,28 +34,282 @@ try:
     HAS_TKINTER = True
 except ImportError:
     HAS_TKINTER = False
+
+# uvloop (libuv) nhanh hơn event loop mặc định; không hỗ trợ Windows
+try:
+    import uvloop
+    HAS_UVLOOP = True
+except ImportError:
+    HAS_UVLOOP = False
+
+# aiohttp chỉ tự giải nén "br" khi có brotli/brotlicffi
+try:
+    import brotli  # noqa: F401
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+# aiodns cho phép aiohttp phân giải DNS bất đồng bộ (AsyncResolver)
+try:
+    import aiodns  # noqa: F401
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
 import aiohttp
+import orjson
 from aiohttp import CookieJar
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from tqdm.asyncio import tqdm_asyncio
-from deep_translator import GoogleTranslator
 
 # ─────────── CONFIG ───────────
-MAX_CONN = 10                  # tổng socket đồng thời
+MAX_CONN = 64                  # tổng socket trong connection pool
+MAX_HTML_CONN = 4              # số trang sản phẩm tải đồng thời (nhẹ nhàng với server)
+MAX_IMG_CONN = 32              # số ảnh tải đồng thời (ảnh tốn băng thông)
+# Parse HTML song song: không cần nhiều process hơn số trang tải đồng thời
+PARSER_WORKERS = min(MAX_HTML_CONN, os.cpu_count() or 1)
+PARSER_POOL_MIN_PRODUCTS = 50  # ít sản phẩm hơn thì parse ngay trong process chính
+RATE_LIMIT = 5.0               # số request/giây tối đa tới ec.coleman.co.jp
+RATE_INCREASE = 0.1            # tăng rate thêm bao nhiêu req/s sau mỗi request thành công
+RECOVER_EVERY = 20             # số ảnh tải thành công trước khi tăng lại limit 1 bậc
+THROTTLE_COOLDOWN = 10.0       # sau một lần giảm, bỏ qua 403/429 khác trong bao lâu (giây)
 MAX_RETRIES = 3                # số lần thử lại khi lỗi
+KEEPALIVE_TIMEOUT = 120        # giữ connection rảnh (giây), đủ dài để qua lúc dịch
+DNS_SERVERS: list[str] | None = None  # None = cấu hình DNS của hệ thống; vd. ["1.1.1.1", "8.8.8.8"]
+MAX_BACKOFF = 8                # thời gian chờ tối đa giữa các lần thử (giây)
+CHUNK_SIZE = 64 * 1024         # kích thước mỗi chunk khi stream ảnh
+URL_CACHE_FILE = Path(".coleman_cache.json")  # nhớ URL ảnh 404/đã tải giữa các lần chạy
+KNOWN_404_TTL = 24 * 3600      # nhớ URL 404 trong bao lâu (giây) trước khi thử lại
+TRANSLATE_CACHE_FILE = Path(".translate_cache.db")  # cache dịch JP -> VI theo từng dòng
+DESC_JSON = "--desc-json" in sys.argv  # lưu mô tả vào desc.json thay cho .jp.txt/.vi.txt
 SLIDE_RANGE = range(1, 16)     # slide 1-15
+# (số slide, key trong dict srcs, tên file) tính sẵn một lần
+SLIDE_KEYS = tuple((slide, str(slide), f"{slide}.jpg") for slide in SLIDE_RANGE)
 SRC_LANG, DST_LANG = "ja", "vi"
-translator = GoogleTranslator(source=SRC_LANG, target=DST_LANG)
+TRANSLATE_SEP = "\n@@@\n"        # phân cách các dòng khi dịch gộp
+TRANSLATE_SPLIT_RE = re.compile(r"\s*@@@\s*")  # Google có thể thêm/bớt khoảng trắng quanh @@@
+TRANSLATE_CHUNK = 4500         # giới hạn ký tự mỗi lần dịch (Google ~5000)
+TRANSLATE_URL = "https://translate.googleapis.com/translate_a/single"
+
+# Chỉ parse <ul class="p-item_info_indt"> (mô tả), ảnh slide lấy bằng regex
+# So theo từng class token: <ul class="p-item_info_indt c-x"> vẫn khớp
+PRODUCT_STRAINER = SoupStrainer(
+    "ul", class_=lambda c: bool(c) and "p-item_info_indt" in c.split())
+ID_SPLIT_RE = re.compile(r"[,\s]+")  # dấu phẩy, xuống dòng, dấu cách
+# <img> đầu tiên bên trong thẻ data-slide (có thể lồng trong <a>, <picture>...),
+# dừng ở thẻ đóng cùng tên hoặc slide kế tiếp
+SLIDE_RE = re.compile(
+    r'<(\w+)\b[^>]*?\sdata-slide="(\d+)"[^>]*>'
+    r'(?:(?!</\1\s*>|data-slide=).)*?<img[^>]*?\ssrc="([^"]+)"', re.S)
 
 # ─────────── LOGGING ───────────
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)-8s %(message)s",
-    handlers=[logging.StreamHandler(),
-              logging.FileHandler("download.log", encoding="utf-8")]
-)
+# Process parse (spawn trên Windows) import lại file này: không gắn thêm FileHandler
+if multiprocessing.parent_process() is None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(levelname)-8s %(message)s",
+        handlers=[logging.StreamHandler(),
+                  logging.FileHandler("download.log", encoding="utf-8")]
+    )
 log = logging.getLogger("coleman")
 
+# ─────────── URL CACHE ───────────
+KNOWN_404: dict[str, float] = {}   # URL ảnh đã trả 404 -> thời điểm (time.time())
+KNOWN_OK: dict[str, str] = {}      # URL ảnh -> file đã tải thành công
+
+def load_url_cache():
+    """Nạp KNOWN_404/KNOWN_OK từ lần chạy trước"""
+    try:
+        data = orjson.loads(URL_CACHE_FILE.read_bytes())
+        entries = data.get("404", {})
+        if isinstance(entries, dict):  # định dạng cũ (list, không có thời điểm) bị bỏ qua
+            KNOWN_404.update(entries)
+        KNOWN_OK.update(data.get("ok", {}))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning("Không đọc được %s: %s", URL_CACHE_FILE, e)
+
+def is_known_404(url: str) -> bool:
+    """URL đã trả 404 trong vòng KNOWN_404_TTL giây gần đây"""
+    ts = KNOWN_404.get(url)
+    return ts is not None and time.time() - ts < KNOWN_404_TTL
+
+def save_url_cache():
+    """Lưu KNOWN_404/KNOWN_OK để dùng cho lần chạy sau"""
+    try:
+        URL_CACHE_FILE.write_bytes(
+            orjson.dumps({"404": {url: ts for url, ts in KNOWN_404.items() if is_known_404(url)},
+                          "ok": KNOWN_OK}))
+    except Exception as e:
+        log.warning("Không ghi được %s: %s", URL_CACHE_FILE, e)
+
+
+# ─────────── TRANSLATE CACHE ───────────
+translate_db: sqlite3.Connection | None = None
+translate_db_lock = threading.Lock()  # connection dùng chung giữa các thread của to_thread
+
+def translate_cache_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def open_translate_cache():
+    """Mở (hoặc tạo) cache dịch trên đĩa"""
+    global translate_db
+    try:
+        translate_db = sqlite3.connect(TRANSLATE_CACHE_FILE, check_same_thread=False)
+        translate_db.execute(
+            "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, vi TEXT NOT NULL)")
+    except sqlite3.Error as e:
+        log.warning("Không mở được %s: %s", TRANSLATE_CACHE_FILE, e)
+        translate_db = None
+
+def close_translate_cache():
+    global translate_db
+    if translate_db is not None:
+        with translate_db_lock:
+            translate_db.close()
+        translate_db = None
+
+def translate_cache_get(keys: list[str]) -> dict[str, str]:
+    """Đọc cache (blocking) - gọi qua asyncio.to_thread"""
+    if translate_db is None or not keys:
+        return {}
+    placeholders = ",".join("?" * len(keys))
+    try:
+        with translate_db_lock:
+            rows = translate_db.execute(
+                f"SELECT key, vi FROM translations WHERE key IN ({placeholders})", keys)
+            return dict(rows)
+    except sqlite3.Error as e:
+        log.warning("Lỗi đọc cache dịch: %s", e)
+        return {}
+
+def translate_cache_put(items: dict[str, str]):
+    """Ghi các bản dịch mới, commit một lần cho cả sản phẩm (blocking) - gọi qua asyncio.to_thread"""
+    if translate_db is None or not items:
+        return
+    try:
+        with translate_db_lock, translate_db:
+            translate_db.executemany(
+                "INSERT OR REPLACE INTO translations (key, vi) VALUES (?, ?)", items.items())
+    except sqlite3.Error as e:
+        log.warning("Lỗi ghi cache dịch: %s", e)
+
+
+# ─────────── CONCURRENCY ───────────
+class AdmissionController:
+    """
+    Giới hạn số request đồng thời giống Semaphore nhưng đổi được limit khi đang chạy.
+    Bị 403/429 thì giảm một nửa (tối đa một lần mỗi `cooldown` giây, để cả loạt response
+    của cùng một đợt chỉ tính là một tín hiệu), sau mỗi `recover_every` lần thành công thì tăng 1.
+    """
+
+    def __init__(self, limit: int, recover_every: int = RECOVER_EVERY,
+                 cooldown: float = THROTTLE_COOLDOWN):
+        self.limit = limit
+        self.max_limit = limit
+        self.recover_every = recover_every
+        self.cooldown = cooldown
+        self.active = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify(1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+    async def set_limit(self, new_limit: int):
+        async with self._cond:
+            new_limit = max(1, min(new_limit, self.max_limit))
+            if new_limit != self.limit:
+                log.info("Giới hạn tải ảnh đồng thời: %d → %d", self.limit, new_limit)
+                self.limit = new_limit
+            self._cond.notify_all()
+
+    async def on_throttled(self):
+        """Server trả 403/429: giảm một nửa số request đồng thời, nếu đã hết cooldown"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        await self.set_limit(self.limit // 2)
+
+    async def on_success(self):
+        """Tăng dần limit trở lại sau một chuỗi request thành công"""
+        if self.limit >= self.max_limit:
+            return
+        self._successes += 1
+        if self._successes >= self.recover_every:
+            self._successes = 0
+            await self.set_limit(self.limit + 1)
+
+
+class RateLimiter:
+    """
+    Token bucket giới hạn số request/giây để server không thấy burst (tránh 403).
+    Bị 403/429 thì giảm rate một nửa (tối đa một lần mỗi `cooldown` giây),
+    mỗi request thành công tăng `increase` (AIMD).
+    """
+
+    def __init__(self, rate: float, increase: float = RATE_INCREASE,
+                 min_rate: float = 0.5, cooldown: float = THROTTLE_COOLDOWN):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.cooldown = cooldown
+        self._last_decrease = float("-inf")
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Giữ lock khi chờ để các request lấy token theo thứ tự
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                capacity = max(1.0, self.rate)  # burst tối đa ~1 giây
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_throttled(self):
+        """Server trả 403/429: giảm một nửa rate, nếu đã hết cooldown"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        new_rate = max(self.min_rate, self.rate / 2)
+        if new_rate != self.rate:
+            log.info("Giới hạn request: %.1f → %.1f req/s", self.rate, new_rate)
+            self.rate = new_rate
+
+    def on_success(self):
+        """Tăng dần rate trở lại sau mỗi request thành công"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
 
 # ─────────── NETWORK HELPERS ───────────
 def get_headers(referer: str | None = None) -> dict:
@@ -51,7 +318,7 @@ def get_headers(referer: str | None = None) -> dict:
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
         "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
+        "Accept-Encoding": "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate",
         "Connection": "keep-alive",
         "Upgrade-Insecure-Requests": "1",
         "Sec-Fetch-Dest": "document",
@@ -64,14 +331,24 @@ def get_headers(referer: str | None = None) -> dict:
         headers["Referer"] = referer
     return headers
 
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff có jitter để các task không thử lại cùng lúc"""
+    return random.uniform(0.1, min(2 ** attempt, MAX_BACKOFF))
+
 async def fetch_html(product_id: str, session: aiohttp.ClientSession, 
+                     limiter: RateLimiter,
                      retries: int = MAX_RETRIES) -> str | None:
     url = f"https://ec.coleman.co.jp/item/{product_id}.html"
     headers = get_headers()
+    throttled = False  # chỉ báo 403/429 một lần cho mỗi trang, không tính các lần thử lại
     for attempt in range(retries):
         try:
+            await limiter.acquire()
             async with session.get(url, headers=headers, allow_redirects=True) as r:
                 if r.status == 200:
+                    limiter.on_success()
+                    log.debug("%s – Content-Encoding: %s", product_id,
+                              r.headers.get("Content-Encoding"))
                     return await r.text()
                 elif r.status == 404:
                     log.error("%s – không tìm thấy (404)", product_id)
@@ -79,6 +356,15 @@ async def fetch_html(product_id: str, session: aiohttp.ClientSession,
                 elif r.status == 403:
                     log.warning("%s – HTTP 403 Forbidden (lần thử %d/%d) - Có thể bị chặn bởi server", 
                               product_id, attempt + 1, retries)
+                    if not throttled:
+                        throttled = True
+                        limiter.on_throttled()
+                elif r.status == 429:
+                    log.warning("%s – HTTP 429 Too Many Requests (lần thử %d/%d)",
+                              product_id, attempt + 1, retries)
+                    if not throttled:
+                        throttled = True
+                        limiter.on_throttled()
                 else:
                     log.warning("%s – HTTP %s (lần thử %d/%d)", product_id, r.status, attempt + 1, retries)
         except asyncio.TimeoutError:
@@ -87,9 +373,8 @@ async def fetch_html(product_id: str, session: aiohttp.ClientSession,
             log.warning("%s – lỗi: %s (lần thử %d/%d)", product_id, e, attempt + 1, retries)
         
         if attempt < retries - 1:
-            # Thêm delay để tránh rate limiting, tăng dần theo số lần thử
-            delay = 2 ** attempt + 0.5  # Thêm 0.5s base delay
-            await asyncio.sleep(delay)
+            # Delay ngẫu nhiên, tăng dần theo số lần thử để tránh rate limiting
+            await asyncio.sleep(backoff_delay(attempt))
     
     log.error("%s – thất bại sau %d lần thử", product_id, retries)
     return None
@@ -98,17 +383,28 @@ async def fetch_html(product_id: str, session: aiohttp.ClientSession,
 async def download_image(url: str, path: Path,
                          session: aiohttp.ClientSession,
                          product_id: str, slide: int,
-                         sem: asyncio.Semaphore,
+                         admission: AdmissionController,
+                         limiter: RateLimiter,
+                         existing: dict[str, int],
                          retries: int = MAX_RETRIES):
-    # Kiểm tra file đã tồn tại và có kích thước hợp lệ
-    if path.exists():
+    if is_known_404(url):
+        log.warning("%s – slide %d không tồn tại (404, đã ghi nhớ trong %s)",
+                    product_id, slide, URL_CACHE_FILE)
+        return  # Đã biết là 404, không cần GET lại
+    # Kiểm tra file đã tồn tại và có kích thước hợp lệ (theo kết quả scan_dir)
+    if existing.get(path.name, 0) > 0:
+        KNOWN_OK[url] = str(path)
+        return  # File đã tồn tại và có dữ liệu
+    # Ảnh dùng chung giữa các sản phẩm: copy từ file đã tải thay vì GET lại
+    known = KNOWN_OK.get(url)
+    if known and known != str(path):
         try:
-            if path.stat().st_size > 0:
-                return  # File đã tồn tại và có dữ liệu
+            await asyncio.to_thread(shutil.copyfile, known, path)
+            return
         except OSError:
-            pass  # File có thể bị lỗi, tải lại
+            KNOWN_OK.pop(url, None)  # File cũ đã mất, tải lại
     
-    async with sem:
+    async with admission:
         # Headers cho ảnh
         headers = get_headers(referer=f"https://ec.coleman.co.jp/item/{product_id}.html")
         headers.update({
@@ -116,21 +412,44 @@ async def download_image(url: str, path: Path,
             "Sec-Fetch-Dest": "image",
             "Sec-Fetch-Mode": "no-cors",
         })
+        tmp_path = path.with_name(path.name + ".part")
+        throttled = False  # chỉ báo 403/429 một lần cho mỗi URL, không tính các lần thử lại
         
         for attempt in range(retries):
             try:
+                await limiter.acquire()
                 async with session.get(url, headers=headers) as r:
                     if r.status == 200:
-                        data = await r.read()
-                        if len(data) > 0:  # Kiểm tra dữ liệu không rỗng
-                            async with aiofiles.open(path, "wb") as f:
-                                await f.write(data)
-                            return  # Thành công
-                        else:
+                        # Stream thẳng xuống file tạm, không giữ cả ảnh trong RAM
+                        written = 0
+                        async with async_open(tmp_path, "wb") as f:
+                            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                                await f.write(chunk)
+                                written += len(chunk)
+                        # Content-Length chỉ đúng khi không bị nén
+                        expected = None if r.headers.get("Content-Encoding") else r.content_length
+                        if written == 0:  # Kiểm tra dữ liệu không rỗng
                             log.warning("%s – slide %d: dữ liệu rỗng", product_id, slide)
+                        elif expected is not None and written != expected:
+                            log.warning("%s – slide %d: thiếu dữ liệu (%d/%d bytes)",
+                                        product_id, slide, written, expected)
+                        else:
+                            tmp_path.replace(path)
+                            KNOWN_OK[url] = str(path)
+                            await admission.on_success()
+                            limiter.on_success()
+                            return  # Thành công
                     elif r.status == 404:
                         log.warning("%s – slide %d không tồn tại (404)", product_id, slide)
+                        KNOWN_404[url] = time.time()
                         return  # Không cần thử lại cho 404
+                    elif r.status in (403, 429):
+                        log.warning("%s – slide %d HTTP %s (lần thử %d/%d) - giảm tốc độ tải",
+                                    product_id, slide, r.status, attempt + 1, retries)
+                        if not throttled:
+                            throttled = True
+                            await admission.on_throttled()
+                            limiter.on_throttled()
                     else:
                         log.warning("%s – slide %d HTTP %s (lần thử %d/%d)", 
                                   product_id, slide, r.status, attempt + 1, retries)
@@ -141,64 +460,161 @@ async def download_image(url: str, path: Path,
                 log.warning("%s – lỗi slide %d: %s (lần thử %d/%d)", 
                           product_id, slide, e, attempt + 1, retries)
             
+            tmp_path.unlink(missing_ok=True)  # Xóa file tải dở
             if attempt < retries - 1:
-                await asyncio.sleep(1 * (attempt + 1))  # Linear backoff
+                await asyncio.sleep(backoff_delay(attempt))
         
         log.error("%s – slide %d thất bại sau %d lần thử", product_id, slide, retries)
 
 # ─────────── CORE ───────────
-async def translate_text(text: str) -> str:
-    """Dịch text trong thread pool để không block event loop"""
-    loop = asyncio.get_event_loop()
+def scan_dir(out_dir: Path) -> dict[str, int]:
+    """
+    Tạo thư mục nếu chưa có, trả về {tên file: kích thước} bằng một lần scandir
+    thay cho exists()/stat() trên từng ảnh.
+    """
+    try:
+        with os.scandir(out_dir) as it:
+            return {e.name: e.stat().st_size for e in it if e.is_file()}
+    except FileNotFoundError:
+        out_dir.mkdir(exist_ok=True)
+        return {}
+
+async def translate_text(text: str, session: aiohttp.ClientSession) -> str | None:
+    """
+    Dịch text qua endpoint Google Translate bằng chính aiohttp session (không cần thread),
+    trả về None nếu lỗi. Dùng POST vì text gộp nhiều dòng có thể dài hơn giới hạn URL.
+    """
+    params = {"client": "gtx", "sl": SRC_LANG, "tl": DST_LANG, "dt": "t"}
     try:
-        return await loop.run_in_executor(None, translator.translate, text)
+        async with session.post(TRANSLATE_URL, params=params, data={"q": text}) as r:
+            if r.status != 200:
+                log.error("Lỗi dịch: HTTP %s", r.status)
+                return None
+            data = await r.json(content_type=None)
+        # data[0] là danh sách các câu: [bản dịch, bản gốc, ...]
+        return "".join(seg[0] for seg in data[0] if seg and seg[0])
     except Exception as e:
         log.error("Lỗi dịch: %s", e)
-        return text  # Trả về text gốc nếu lỗi
+        return None
+
+def chunk_lines(lines: list[str], limit: int = TRANSLATE_CHUNK) -> list[list[str]]:
+    """Gom các dòng thành từng nhóm sao cho mỗi nhóm (kể cả phân cách) <= limit ký tự"""
+    chunks: list[list[str]] = []
+    cur: list[str] = []
+    size = 0
+    for line in lines:
+        extra = len(line) + (len(TRANSLATE_SEP) if cur else 0)
+        if cur and size + extra > limit:
+            chunks.append(cur)
+            cur, size = [], 0
+            extra = len(line)
+        cur.append(line)
+        size += extra
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+async def translate_lines(lines: list[str], session: aiohttp.ClientSession) -> list[str]:
+    """
+    Dịch nhiều dòng bằng ít request nhất có thể:
+    bỏ qua các dòng đã có trong cache, gộp các dòng còn lại bằng TRANSLATE_SEP,
+    dịch một lần rồi tách lại. Chỉ dịch lại từng dòng khi request thành công nhưng
+    số dòng sau khi tách không khớp. Request lỗi không được thử lại từng dòng:
+    các dòng đó giữ nguyên text gốc và không được lưu vào cache.
+    """
+    keys = [translate_cache_key(line) for line in lines]
+    cached = await asyncio.to_thread(translate_cache_get, list(set(keys)))
+    missing = list(dict.fromkeys(line for line, key in zip(lines, keys) if key not in cached))
+
+    fresh: dict[str, str] = {}
+    for chunk in chunk_lines(missing):
+        translated = await translate_text(TRANSLATE_SEP.join(chunk), session)
+        if translated is None:
+            continue  # Lỗi request (vd. 429): không nhân thành len(chunk) request nữa
+        if len(chunk) == 1:
+            parts = [translated]
+        else:
+            parts = TRANSLATE_SPLIT_RE.split(translated)
+            if len(parts) != len(chunk):
+                parts = await asyncio.gather(*(translate_text(line, session) for line in chunk))
+        for line, part in zip(chunk, parts):
+            if part is not None:
+                fresh[line] = part.strip()
+    await asyncio.to_thread(
+        translate_cache_put, {translate_cache_key(line): vi for line, vi in fresh.items()})
+
+    return [cached[key] if key in cached else fresh.get(line, line)
+            for line, key in zip(lines, keys)]
+
+def parse_product_html(html: str) -> tuple[list[str] | None, dict[str, str]]:
+    """
+    Trích mô tả (JP) và src ảnh các slide ra list/dict thuần Python.
+    Trả về (jp_lines, srcs); jp_lines là None nếu không có <ul> mô tả.
+    """
+    # Lấy src ảnh của mọi slide trong một lần quét regex trên HTML thô
+    srcs: dict[str, str] = {}
+    for _tag, slide_no, src in SLIDE_RE.findall(html):
+        srcs.setdefault(slide_no, htmllib.unescape(src))  # giữ slide xuất hiện đầu tiên
 
-async def save_descriptions(soup: BeautifulSoup, out_dir: Path,
-                            product_id: str):
+    soup = BeautifulSoup(html, "lxml", parse_only=PRODUCT_STRAINER)
     ul = soup.find("ul", class_="p-item_info_indt")
     if not ul:
+        return None, srcs
+    texts = (li.get_text(strip=True) for li in ul.find_all("li"))
+    return [t for t in texts if t], srcs
+
+async def save_descriptions(jp_lines: list[str] | None, out_dir: Path,
+                            product_id: str, session: aiohttp.ClientSession):
+    if jp_lines is None:
         log.warning("%s – không tìm <ul>", product_id)
         return
-    jp_lines = [li.get_text(strip=True) for li in ul.find_all("li") if li.get_text(strip=True)]
     if not jp_lines:
         log.warning("%s – <ul> rỗng", product_id)
         return
 
-    # JP
-    jp_path = out_dir / f"{product_id}.jp.txt"
-    async with aiofiles.open(jp_path, "w", encoding="utf-8") as f:
-        await f.write("\n".join(jp_lines))
-    
-    # VI - dịch song song để tăng tốc
-    vi_tasks = [translate_text(line) for line in jp_lines]
-    vi_lines = await asyncio.gather(*vi_tasks)
-    
-    vi_path = out_dir / f"{product_id}.vi.txt"
-    async with aiofiles.open(vi_path, "w", encoding="utf-8") as f:
-        await f.write("\n".join(vi_lines))
-    log.info("%s – đã lưu jp.txt & vi.txt", product_id)
+    # VI - dịch gộp nhiều dòng trong một request
+    vi_lines = await translate_lines(jp_lines, session)
+
+    # File nhỏ: ghi đồng bộ trong thread nhanh hơn mở file async + write
+    if DESC_JSON:
+        # JP + VI trong một file desc.json: một lần mở, một lần ghi
+        payload = orjson.dumps({"pid": product_id, "jp": jp_lines, "vi": vi_lines})
+        await asyncio.to_thread((out_dir / "desc.json").write_bytes, payload)
+        log.info("%s – đã lưu desc.json", product_id)
+    else:
+        jp_path = out_dir / f"{product_id}.jp.txt"
+        await asyncio.to_thread(jp_path.write_text, "\n".join(jp_lines), encoding="utf-8")
+        vi_path = out_dir / f"{product_id}.vi.txt"
+        await asyncio.to_thread(vi_path.write_text, "\n".join(vi_lines), encoding="utf-8")
+        log.info("%s – đã lưu jp.txt & vi.txt", product_id)
 
 async def handle_product(pid: str, session: aiohttp.ClientSession,
-                         sem: asyncio.Semaphore):
-    html = await fetch_html(pid, session)
+                         html_sem: asyncio.Semaphore,
+                         admission: AdmissionController,
+                         limiter: RateLimiter,
+                         parser_pool: ProcessPoolExecutor | None):
+    async with html_sem:
+        html = await fetch_html(pid, session, limiter)
     if html is None:
         return
-    soup = BeautifulSoup(html, "html.parser")
+    if parser_pool is None:
+        jp_lines, srcs = parse_product_html(html)
+    else:
+        # Parse trong process khác để không chiếm GIL/event loop
+        loop = asyncio.get_running_loop()
+        jp_lines, srcs = await loop.run_in_executor(parser_pool, parse_product_html, html)
+    # Giải phóng HTML (và DOM) trước khi dịch/tải ảnh để giảm RAM đỉnh
+    del html
     out_dir = Path(pid)
-    out_dir.mkdir(exist_ok=True)
+    existing = scan_dir(out_dir)
 
     # 1) Mô tả
-    await save_descriptions(soup, out_dir, pid)
+    await save_descriptions(jp_lines, out_dir, pid, session)
 
     # 2) Ảnh
     tasks = []
-    for slide in SLIDE_RANGE:
-        tag = soup.find(attrs={"data-slide": str(slide)})
-        img_tag = tag.find("img") if tag else None
-        src = img_tag["src"] if img_tag and img_tag.has_attr("src") else None
+    for slide, key, filename in SLIDE_KEYS:
+        src = srcs.get(key)
         if not src:
             log.warning("%s – thiếu slide %d", pid, slide)
             continue
@@ -206,8 +622,9 @@ async def handle_product(pid: str, session: aiohttp.ClientSession,
             src = "https:" + src
         elif src.startswith("/"):
             src = "https://ec.coleman.co.jp" + src
-        path = out_dir / f"{slide}.jpg"
-        tasks.append(download_image(src, path, session, pid, slide, sem))
+        path = out_dir.joinpath(filename)
+        tasks.append(download_image(src, path, session, pid, slide,
+                                    admission, limiter, existing))
 
     if tasks:
         await tqdm_asyncio.gather(*tasks, desc=pid, unit="img")
@@ -216,13 +633,31 @@ async def handle_product(pid: str, session: aiohttp.ClientSession,
 
 # ─────────── MAIN ───────────
 async def main(product_ids: list[str]):
-    sem = asyncio.Semaphore(MAX_CONN)
+    # Tách giới hạn: tải ảnh không phải xếp hàng sau các request HTML
+    html_sem = asyncio.Semaphore(MAX_HTML_CONN)
+    admission = AdmissionController(MAX_IMG_CONN)
+    # Giới hạn request/giây chung cho cả HTML và ảnh (cùng host)
+    limiter = RateLimiter(RATE_LIMIT)
+    # aiodns cần SelectorEventLoop trên Windows (mặc định là Proactor) nên chỉ dùng ở nơi khác
+    resolver = None
+    if HAS_AIODNS and sys.platform != "win32":
+        try:
+            # Mặc định theo DNS hệ thống (VPN, split DNS...), chỉ dùng DNS_SERVERS khi đặt rõ
+            resolver = (aiohttp.AsyncResolver(nameservers=DNS_SERVERS) if DNS_SERVERS
+                        else aiohttp.AsyncResolver())
+        except RuntimeError as e:
+            log.warning("Không dùng được AsyncResolver: %s (dùng resolver mặc định)", e)
     # Tối ưu connector: tăng limit_per_host để tải ảnh nhanh hơn
     connector = aiohttp.TCPConnector(
-        limit=MAX_CONN * 2,  # Tăng tổng connection pool
-        limit_per_host=MAX_CONN,  # Cho phép nhiều connection hơn đến cùng host
-        ttl_dns_cache=300,  # Cache DNS 5 phút
-        force_close=False  # Tái sử dụng connection
+        limit=MAX_CONN,  # Tổng connection pool
+        limit_per_host=MAX_HTML_CONN + MAX_IMG_CONN,  # Đủ cho cả HTML và ảnh cùng host
+        resolver=resolver,
+        family=socket.AF_INET,  # Chỉ IPv4, bỏ qua truy vấn AAAA
+        use_dns_cache=True,
+        ttl_dns_cache=3600,  # Cache DNS 1 giờ (warm-up request sẽ làm nóng cache)
+        force_close=False,  # Tái sử dụng connection
+        keepalive_timeout=KEEPALIVE_TIMEOUT,  # Mặc định 15s, ngắn hơn thời gian dịch
+        enable_cleanup_closed=True,  # Dọn các SSL transport đóng không sạch
     )
 
     timeout = aiohttp.ClientTimeout(total=180, connect=30)
@@ -233,25 +668,53 @@ async def main(product_ids: list[str]):
     # Sử dụng CookieJar để lưu cookies và giữ session
     cookie_jar = CookieJar(unsafe=True)  # unsafe=True để chấp nhận cookies từ mọi domain
     
-    async with aiohttp.ClientSession(
-        connector=connector, 
-        timeout=timeout,
-        headers=default_headers,
-        cookie_jar=cookie_jar
-    ) as sess:
-        # Warm-up: request đến trang chủ để lấy cookies ban đầu
-        try:
-            log.info("Đang khởi tạo session...")
-            async with sess.get("https://ec.coleman.co.jp/", headers=get_headers()) as r:
-                if r.status == 200:
-                    log.info("✓ Session đã được khởi tạo")
-                else:
-                    log.warning("⚠️  Warm-up request trả về HTTP %s", r.status)
-        except Exception as e:
-            log.warning("⚠️  Lỗi warm-up: %s (tiếp tục...)", e)
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, 
+            timeout=timeout,
+            headers=default_headers,
+            cookie_jar=cookie_jar
+        ) as sess:
+            # Warm-up: request đến trang chủ để lấy cookies ban đầu
+            try:
+                log.info("Đang khởi tạo session...")
+                async with sess.get("https://ec.coleman.co.jp/", headers=get_headers()) as r:
+                    if r.status == 200:
+                        log.info("✓ Session đã được khởi tạo")
+                    else:
+                        log.warning("⚠️  Warm-up request trả về HTTP %s", r.status)
+            except Exception as e:
+                log.warning("⚠️  Lỗi warm-up: %s (tiếp tục...)", e)
         
-        tasks = [handle_product(pid, sess, sem) for pid in product_ids]
-        await tqdm_asyncio.gather(*tasks, desc="Tổng tiến độ", unit="sản phẩm")
+            load_url_cache()
+            open_translate_cache()
+            # Hàng đợi nhỏ: chi phí khởi động process lớn hơn thời gian parse (~16ms/trang)
+            parser_pool = (ProcessPoolExecutor(max_workers=PARSER_WORKERS)
+                           if len(product_ids) >= PARSER_POOL_MIN_PRODUCTS else None)
+            try:
+                tasks = [handle_product(pid, sess, html_sem, admission, limiter, parser_pool)
+                         for pid in product_ids]
+                await tqdm_asyncio.gather(*tasks, desc="Tổng tiến độ", unit="sản phẩm")
+            finally:
+                if parser_pool is not None:
+                    parser_pool.shutdown()
+                save_url_cache()
+                close_translate_cache()
+    finally:
+        # Resolver truyền từ ngoài vào không do connector quản lý nên phải tự đóng
+        if resolver is not None:
+            await resolver.close()
+
+def run_main(product_ids: list[str]):
+    """Chạy main() trên uvloop nếu có, ngược lại dùng event loop mặc định"""
+    if not HAS_UVLOOP:
+        asyncio.run(main(product_ids))
+    elif sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main(product_ids))
+    else:
+        uvloop.install()
+        asyncio.run(main(product_ids))
 
 # ─────────── FILE PARSING ───────────
 def select_file_dialog() -> str | None:
@@ -302,24 +765,13 @@ def parse_product_ids_from_file(file_path: str) -> list[str]:
             log.warning("File rỗng: %s", file_path)
             return []
         
-        # Tách theo nhiều delimiter: dấu phẩy, xuống dòng, dấu cách
-        # Sử dụng regex để tách theo tất cả các delimiter
-        ids = re.split(r'[,\s\n]+', content)
-        
-        # Lọc và làm sạch: chỉ lấy số, loại bỏ rỗng
-        product_ids = []
-        for item in ids:
-            cleaned = item.strip()
-            if cleaned and cleaned.isdigit():
-                product_ids.append(cleaned)
-        
-        # Loại bỏ trùng lặp nhưng giữ nguyên thứ tự
-        seen = set()
-        unique_ids = []
-        for pid in product_ids:
-            if pid not in seen:
-                seen.add(pid)
-                unique_ids.append(pid)
+        # Tách theo tất cả các delimiter, chỉ lấy số và loại bỏ trùng lặp
+        # trong một lượt (dict giữ nguyên thứ tự chèn)
+        seen: dict[str, None] = {}
+        for item in ID_SPLIT_RE.split(content):
+            if item.isdigit() and item not in seen:
+                seen[item] = None
+        unique_ids = list(seen)
         
         log.info("Đã đọc %d mã sản phẩm từ file %s", len(unique_ids), file_path)
         return unique_ids
@@ -333,6 +785,10 @@ if __name__ == "__main__":
     
     print("=" * 50)
     print("Coleman Product Downloader")
+    if DESC_JSON:
+        print("Mô tả: lưu vào desc.json (--desc-json)")
+    else:
+        print("Mô tả: lưu vào <mã>.jp.txt & <mã>.vi.txt (chạy với --desc-json để lưu desc.json)")
     print("=" * 50)
     print("Chọn chế độ:")
     print("  1. Nhập mã thủ công")
@@ -420,5 +876,5 @@ if __name__ == "__main__":
         print("Chưa có mã nào ➜ thoát.")
     else:
         print(f"\n🚀 Bắt đầu tải {len(queue)} sản phẩm...\n")
-        asyncio.run(main(queue))
+        run_main(queue)
         print("\n🎉  Xong! Kiểm tra các thư mục sản phẩm và file download.log.")